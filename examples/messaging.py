@@ -1,5 +1,4 @@
 from pyuwb import UwbModule, find_uwb_serial_ports
-import numpy as np
 import msgpack
 """
 This script publishes a message to the USB port continuously until terminated.
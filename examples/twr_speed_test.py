@@ -21,7 +21,6 @@ for i in range(num_trials):
 
 freq_with_python = 1/((time.time() - start_time)/num_trials)
 
-uwb1.close() # shuts down the internal threads.
 time.sleep(1)
 
 # Just send raw command directly. Skips the interfaces' packing/unpacking 
@@ -37,6 +36,8 @@ for i in range(num_trials):
     counter += 1
 freq_without_python = 1/((time.time() - start_time)/num_trials)
 
+uwb1.close() # closes the serial port.
+
 
 print("Average frequency with python interface:")
 print(str(freq_with_python) + "Hz")
@@ -1,9 +1,14 @@
 import struct
-from typing import Any, List
+from typing import Any, Callable, List, Tuple
 from abc import ABC, abstractmethod
 
 encoding = "utf-8"
 
+# Precompiled binary layouts, so the format string is not re-parsed on every
+# packed/unpacked field.
+_float_struct = struct.Struct("<f")
+_length_struct = struct.Struct("<H")
+
 
 class Field(ABC):
     """
@@ -21,8 +26,16 @@ class Field(ABC):
     second output argument, it is mandatory to provide the index of the first
     byte of the following field in the message.
 
+    Fields whose content always ends at the next key character are
+    `delimited`. Those are only ever handed the bytes of the field itself.
+    Fields that determine their own length, and may therefore contain key
+    characters, must set `delimited = False`. Those are handed the rest of
+    the message, possibly as a memoryview.
+
     """
 
+    delimited = True
+
     @staticmethod
     @abstractmethod
     def pack(value: Any) -> bytes:
@@ -42,20 +55,20 @@ class IntField(Field):
 
     @staticmethod
     def unpack(msg: bytes, next_key_idx: int) -> int:
-        return int(msg[:next_key_idx].decode(encoding)), next_key_idx
+        return int(msg[:next_key_idx]), next_key_idx
 
 
 class BoolField(Field):
     @staticmethod
     def pack(value: bool) -> bytes:
-        return str(int(value)).encode(encoding)
+        return b"1" if value else b"0"
 
     @staticmethod
     def unpack(msg: bytes, next_key_idx: int) -> bool:
         if next_key_idx != 1:
             raise RuntimeError("Bool field is more than 1 byte..")
 
-        return bool(msg[:next_key_idx].decode(encoding)), next_key_idx
+        return bool(int(msg[:next_key_idx])), next_key_idx
 
 
 class StringField(Field):
@@ -71,24 +84,28 @@ class StringField(Field):
 class FloatField(Field):
     @staticmethod
     def pack(value: float) -> bytes:
-        return struct.pack("<f", value)
+        return _float_struct.pack(value)
 
     @staticmethod
     def unpack(msg: bytes, next_key_idx: int) -> float:
-        return float(msg[:next_key_idx].decode(encoding)), next_key_idx
+        return float(msg[:next_key_idx]), next_key_idx
 
 
 class ByteField(Field):
+    delimited = False
+
     @staticmethod
     def pack(value: bytes) -> bytes:
         num_bytes = len(value)
-        return struct.pack("<H", num_bytes) + value
+        return b"".join((_length_struct.pack(num_bytes), value))
 
     @staticmethod
     def unpack(msg: bytes, next_key_idx: int) -> bytes:
-        fieldlen = struct.unpack("<H", msg[:2])
+        fieldlen = _length_struct.unpack_from(msg)
 
-        return msg[2 : 2 + fieldlen[0]], 2 + fieldlen[0]
+        # `msg` may be a memoryview of a larger buffer, so copy out only the
+        # payload.
+        return bytes(msg[2 : 2 + fieldlen[0]]), 2 + fieldlen[0]
 
 
 class Packer:
@@ -139,10 +156,92 @@ class Packer:
 
         return results, msg_end_idx
 
-    def get_next_key_char(self, msg: bytes):
+    def compile_packer(
+        self, field_types: List[Field], prefix: bytes = b""
+    ) -> Callable[[List[Any]], bytes]:
+        """
+        Generates a specialized packing function for a fixed list of field
+        types. Calling the returned function with a list of values is
+        equivalent to `prefix + pack(values, field_types)`, but the fields are
+        packed in straight-line generated code. Messages without any fields
+        are packed only once.
+        """
+        if field_types is None or len(field_types) == 0:
+            msg = prefix + self._terminator
+            return lambda field_values: msg
+
+        namespace = {
+            "_prefix": prefix,
+            "_sep": self._separator,
+            "_term": self._terminator,
+        }
+        values = "".join("v{0}, ".format(i) for i in range(len(field_types)))
+        parts = ["_prefix"]
+        for i, field in enumerate(field_types):
+            namespace["_pack{0}".format(i)] = field.pack
+            parts += ["_sep", "_pack{0}(v{0})".format(i)]
+        parts.append("_term")
+        lines = [
+            "def _pack(field_values):",
+            "    {0}= field_values".format(values),
+            "    return b''.join(({0}))".format(", ".join(parts)),
+        ]
+
+        exec("\n".join(lines), namespace)
+        return namespace["_pack"]
+
+    def compile_unpacker(
+        self, field_types: List[Field]
+    ) -> Callable[[bytes, int], Tuple[List[Any], int]]:
+        """
+        Generates a specialized unpacking function for a fixed list of field
+        types. Calling the returned function as `f(msg, start)` is equivalent
+        to calling `unpack(msg[start:], field_types)`, but the fields are
+        unpacked in straight-line generated code instead of a loop over
+        `field_types`, and without copying the rest of the message for every
+        field.
+        """
+        namespace = {
+            "_next_key": self.get_next_key_char,
+            "_term": self._terminator,
+        }
+        if field_types is None or len(field_types) == 0:
+            lines = [
+                "def _unpack(msg, start=0):",
+                "    idx = msg.find(_term, start)",
+                "    return [], (-1 if idx == -1 else idx - start)",
+            ]
+            exec("\n".join(lines), namespace)
+            return namespace["_unpack"]
+
+        lines = ["def _unpack(msg, start=0):", "    idx = start"]
+        if not all(field.delimited for field in field_types):
+            # Slicing a view does not copy the rest of the buffer.
+            lines.append("    view = memoryview(msg)")
+        for i, field in enumerate(field_types):
+            namespace["_unpack{0}".format(i)] = field.unpack
+            if field.delimited:
+                field_bytes = "msg[idx:key]"
+            else:
+                field_bytes = "view[idx:]"
+            lines += [
+                "    idx += 1",
+                "    key = _next_key(msg, idx)",
+                "    v{0}, n = _unpack{0}({1}, key - idx)".format(
+                    i, field_bytes
+                ),
+                "    idx += n",
+            ]
+        values = ", ".join("v{0}".format(i) for i in range(len(field_types)))
+        lines.append("    return [{0}], idx - start".format(values))
+
+        exec("\n".join(lines), namespace)
+        return namespace["_unpack"]
+
+    def get_next_key_char(self, msg: bytes, start: int = 0):
         # Find the "soonest" key character (separator or terminator)
-        next_sep = msg.find(self._separator)
-        next_eol = msg.find(self._terminator)
+        next_sep = msg.find(self._separator, start)
+        next_eol = msg.find(self._terminator, start)
         if next_sep == -1 and next_eol == -1:
             raise RuntimeError(
                 "No separator or terminator detected in received message."
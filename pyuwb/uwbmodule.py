@@ -1,12 +1,17 @@
-import struct
+import io
+import os
+import re
+import select
+import sys
 import serial
 from serial.tools import list_ports
 import time
 from datetime import datetime
 import threading
-import queue
 import msgpack
 import traceback
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from .packing import (
     Packer,
@@ -17,6 +22,10 @@ from .packing import (
     ByteField,
 )
 
+# Constant payload sent to the firmware by `UwbModule.do_tests()`.
+_TEST_DICT = {"a": 3.14159, "b": [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]}
+_TEST_PAYLOAD = msgpack.packb(_TEST_DICT, use_single_float=True)
+
 
 def find_uwb_serial_ports():
     """
@@ -27,18 +36,58 @@ def find_uwb_serial_ports():
     list[port path: string]:
         list of paths to the serial ports that have a UWB device
     """
-    ports = list_ports.comports()
+    ports = [port.device for port in list_ports.comports()]
     uwb_ports = []
-    for port in ports:
-        uwb = UwbModule(port.device, baudrate=19200, timeout=1, verbose=True)
-        id_dict = uwb.get_id()
-        if id_dict["is_valid"]:
-            uwb_ports.append(port.device)
-        uwb.close()
-    time.sleep(1)
+    if len(ports) > 0:
+        # Each probe owns its own serial port, so all ports can be probed
+        # concurrently and the scan only takes as long as the slowest port.
+        with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+            results = list(executor.map(_probe_uwb_serial_port, ports))
+        uwb_ports = [port for port in results if port is not None]
     return uwb_ports
 
 
+def _probe_uwb_serial_port(port):
+    """
+    Checks whether a UWB module is connected to a specific serial port.
+
+    RETURNS:
+    --------
+    port path: string, or None if no UWB module responded on this port
+    """
+    # The port may belong to some other device or program, so its latency
+    # timer is left alone. Only modules that are actually used lower it.
+    with UwbModule(
+        port, baudrate=19200, timeout=1, verbose=True, low_latency=False
+    ) as uwb:
+        id_dict = uwb.get_id()
+    if id_dict["is_valid"]:
+        return port
+    else:
+        return None
+
+
+def _set_low_latency_timer(port):
+    """
+    USB-serial adapters such as FTDI chips hold on to received bytes for up
+    to 16 ms by default before passing them on. On Linux, this delay can be
+    lowered to 1 ms through sysfs. Nothing is done if the port has no such
+    timer or it cannot be written to (e.g. insufficient permissions).
+    """
+    if not sys.platform.startswith("linux"):
+        return
+
+    device_name = os.path.basename(os.path.realpath(port))
+    timer_path = "/sys/bus/usb-serial/devices/{0}/latency_timer".format(
+        device_name
+    )
+    try:
+        with open(timer_path, "w") as timer_file:
+            timer_file.write("1")
+    except OSError:
+        pass
+
+
 class UwbModule(object):
     """
     Main interface object for DECAR/MRASL UWB modules.
@@ -57,44 +106,64 @@ class UwbModule(object):
         TODO: get rid of logging?
     threaded: bool
         DEPRECATED. if true, initializes this module in a multi-threaded mode with  
-        serial port monitoring and callback execution executing in other threads.
+        serial port monitoring and callback execution executing in another
+        thread. Callbacks run directly in the monitoring thread, so they must
+        not block, nor send commands to this module, as their response could
+        only be read by that same thread. Exceptions raised by callbacks are
+        printed rather than stopping the thread.
         TODO: remove this option completely. 
+    low_latency: bool
+        if true, the USB-serial latency timer of the port is lowered to 1 ms
+        on Linux, where supported. This is ignored on other platforms, or if
+        the timer cannot be changed.
     """
 
     _encoding = "utf-8"
+    _read_size = 4096
+    # Max time, in seconds, that logged lines may sit in the write buffer.
+    _log_flush_interval = 1.0
     _c_format_dict = {
-        "C00": [],
-        "C01": [],
-        "C02": [],
-        "C03": [IntField, StringField, BoolField, FloatField, ByteField],
-        "C04": [BoolField],
-        "C05": [IntField, BoolField, BoolField, BoolField],
-        "C06": [ByteField],
-        "C07": [],
-        "C08": [IntField],
+        b"C00": (),
+        b"C01": (),
+        b"C02": (),
+        b"C03": (IntField, StringField, BoolField, FloatField, ByteField),
+        b"C04": (BoolField,),
+        b"C05": (IntField, BoolField, BoolField, BoolField),
+        b"C06": (ByteField,),
+        b"C07": (),
+        b"C08": (IntField,),
     }
     _r_format_dict = {
-        "R00": [],
-        "R01": [IntField],
-        "R02": [],
-        "R03": [
+        b"R00": (),
+        b"R01": (IntField,),
+        b"R02": (),
+        b"R03": (
             IntField,
             IntField,
             StringField,
             BoolField,
             FloatField,
             ByteField,
-        ],
-        "R04": [],
-        "R05": [IntField, FloatField] + [IntField] * 6 + [FloatField] * 4,
-        "R06": [],
-        "R07": [IntField],
-        "R08": [],
-        "S01": [IntField] * 11 + [FloatField] * 6 + [FloatField] * 4,
-        "S05": [IntField, FloatField] + [IntField] * 6 + [FloatField] * 4,
-        "S06": [ByteField],
-        "S10": [IntField] * 4 + [IntField] * 1016,
+        ),
+        b"R04": (),
+        b"R05": (IntField, FloatField) + (IntField,) * 6 + (FloatField,) * 4,
+        b"R06": (),
+        b"R07": (IntField,),
+        b"R08": (),
+        b"S01": (IntField,) * 11 + (FloatField,) * 6 + (FloatField,) * 4,
+        b"S05": (IntField, FloatField) + (IntField,) * 6 + (FloatField,) * 4,
+        b"S06": (ByteField,),
+        b"S10": (IntField,) * 4 + (IntField,) * 1016,
     }
+    _msg_key_regex = re.compile(
+        b"|".join(re.escape(key) for key in _r_format_dict)
+    )
+
+    # The unpackers and packers generated from the formats above. They are
+    # the same for every instance, so they are only generated once.
+    _parsers = None
+    _command_packers = None
+    _compile_lock = threading.Lock()
 
     def __init__(
         self,
@@ -104,64 +173,89 @@ class UwbModule(object):
         verbose=False,
         log=False,
         threaded=False,
+        low_latency=True,
     ):
         """
         Constructor
         """
         self.device = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+        if low_latency:
+            _set_low_latency_timer(port)
+        try:
+            self._fd = self.device.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            # Not a POSIX serial port (e.g. Windows), whose backends either
+            # lack fileno() or inherit the one from io.RawIOBase.
+            self._fd = None
         self.verbose = verbose
         self.timeout = timeout
         self.logging = log
         self._threaded = threaded
         self.id = ""
 
-        self._r_format_dict = {
-            key.encode(self._encoding): val
-            for key, val in self._r_format_dict.items()
-        }
-        self._c_format_dict = {
-            key.encode(self._encoding): val
-            for key, val in self._c_format_dict.items()
-        }
         self.packer = Packer(separator="|", terminator="\r")
+        self._compile_formats(self.packer)
 
         # Logging
         self._log_filename = None
+        self._log_file = None
+        self._log_flush_deadline = 0.0
 
         # Messaging internal variables.
+        self._rx_buf = bytearray()
+        self._rx_partial = False
         self._max_frame_len = None
         self._receivers = {}
+        self._batch_receivers = {}
         self._response_container = {}
-        self._callbacks = {}
+        self._callbacks = defaultdict(list)
 
         # Start a separate thread for serial port monitoring
         if self._threaded:
             self._kill_monitor = False
-            self._msg_queue = queue.Queue()
-            self._response_condition = threading.Condition()
+            self._response_events = {
+                key: threading.Event() for key in self._r_format_dict
+            }
             self._main_thread = threading.main_thread()
 
             self._monitor_thread = threading.Thread(
                 target=self._serial_monitor, name="Serial Monitor"
             )
 
-            self._dispatcher_thread = threading.Thread(
-                target=self._cb_dispatcher, name="Callback Dispatcher"
-            )
-
             self._monitor_thread.start()
-            self._dispatcher_thread.start()
         else: 
-            self._msg_queue = []
+            self._msg_queue = deque()
 
         self.id = self.get_id()['id']
 
+    @classmethod
+    def _compile_formats(cls, packer):
+        """
+        Generates the unpackers and packers for all message formats, unless
+        that was already done by another instance.
+        """
+        # Modules may be constructed from several threads at once, e.g. by
+        # find_uwb_serial_ports().
+        with cls._compile_lock:
+            if cls._parsers is not None:
+                return
+
+            cls._parsers = {
+                key: packer.compile_unpacker(val)
+                for key, val in cls._r_format_dict.items()
+            }
+            cls._command_packers = {
+                key: packer.compile_packer(val, prefix=key)
+                for key, val in cls._c_format_dict.items()
+            }
+
     def _serial_monitor(self):
         """
         SERIAL MONITOR THREAD
 
         Continuously monitors the serial port, watching for official messages.
-        If an official message is detected, it is extracted and stored in a queue.
+        If an official message is detected, it is extracted, stored as the
+        latest response, and any registered callbacks are executed.
         """
         time_to_exit = False
         while True:
@@ -175,29 +269,8 @@ class UwbModule(object):
             self._read_and_unpack()
 
             if time_to_exit:
-                self._msg_queue.put(None)  # Signals CB dispatcher to exit.
                 break  # Exits this thread.
 
-    def _cb_dispatcher(self):
-        """
-        CALLBACK DISPATCHER THREAD
-
-        Thread which executes callbacks by watching a queue of messages received
-        from the firmware.
-
-        This thread will shutdown when it receives a 'None' on the queue.
-        """
-        while True:
-            # Waits
-            msg = self._msg_queue.get()
-            if msg is None:
-                break  # Shut down the thread.
-            else:
-                msg_key, field_values = msg
-                self._execute_callbacks(msg_key, field_values)
-
-                
-
     def _send(self, message: bytes):
         """
         Send an arbitrary string to the UWB device.
@@ -208,107 +281,165 @@ class UwbModule(object):
             )  
 
         if self.verbose:
-            print("{0} << ".format(self.id), end="")
-            print(str(message)[2:-1])
+            print("{0} << {1}".format(self.id, str(message)[2:-1]))
 
         self.device.write(message)
 
-    def _read(self) -> bytes:
+    def _read(self, timeout=None) -> bytes:
         """
-        Read arbitrary string from UWB device.
+        Read arbitrary string from UWB device, waiting for up to `timeout`
+        seconds. If `timeout=None`, the serial port's timeout is used.
         """
-        # Here we use pyserial's readline() command to take advantage of the
-        # built-in timeout feature. This lets us wait a bit for messages to
-        # arrive over USB. However, once we do recieve a message, we immediately
-        # call read(device.in_waiting) to also read whatever else is in the
-        # input buffer.
-        out = self.device.read_until(b"\r\n")
-        out += self.device.read(self.device.in_waiting)
+        if timeout is None:
+            timeout = self.device.timeout
+
+        if self._fd is not None:
+            # Wait on the raw file descriptor for up to the serial timeout,
+            # then grab everything that has arrived with a single system call
+            # rather than letting pyserial search for a terminator byte by
+            # byte. Partial messages are handled by the caller's buffer.
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if ready:
+                out = chunk = os.read(self._fd, self._read_size)
+
+                # A full chunk means more may already be waiting, such as the
+                # rest of a long CIR message. Grab it now rather than on the
+                # next call.
+                while len(chunk) == self._read_size:
+                    ready, _, _ = select.select([self._fd], [], [], 0)
+                    if not ready:
+                        break
+                    chunk = os.read(self._fd, self._read_size)
+                    out += chunk
+            else:
+                out = b""
+        else:
+            # Here we read a single byte to take advantage of pyserial's
+            # built-in timeout feature. This lets us wait a bit for messages
+            # to arrive over USB, but returns as soon as anything arrives.
+            # We then immediately call read(device.in_waiting) to also read
+            # whatever else is in the input buffer. The port timeout is only
+            # touched when a different one is requested, as every change
+            # reconfigures the device.
+            old_timeout = self.device.timeout
+            if timeout != old_timeout:
+                self.device.timeout = timeout
+            out = self.device.read(1)
+            if len(out) > 0:
+                out += self.device.read(self.device.in_waiting)
+            if timeout != old_timeout:
+                self.device.timeout = old_timeout
 
         if self.verbose and len(out) > 0:
-            print("{0} >> ".format(self.id), end="")
-            print(str(out)[2:-1])
+            print("{0} >> {1}".format(self.id, str(out)[2:-1]))
         return out
 
-    def _read_and_unpack(self):
+    def _read_and_unpack(self, timeout=None):
 
         # This line may block for a short timeout using pyserial's
-        # timeout functionality. 
-        out = self._read()
-
-        if len(out) > 0:
-
-            # Temporary variable will act as buffer that is progressively
-            # "consumed" as the message is processed left-to-right.
-            temp = out
-            counter = 0
-            while len(temp) >= 4 and counter < 100: 
-                counter += 1 # Failsafe
-
-                # Find soonest of "R" or "S"
-                next_r_idx = temp.find(b"R")
-                next_s_idx = temp.find(b"S")
-                if next_r_idx == -1 and next_s_idx == -1:
-                    next_msg_idx = -1
-                elif next_r_idx == -1:
-                    next_msg_idx = next_s_idx
-                elif next_s_idx == -1:
-                    next_msg_idx = next_r_idx
-                else:
-                    next_msg_idx = min(next_r_idx, next_s_idx)
-
-                if next_msg_idx == -1:
-                    # No message start found, exit loop
+        # timeout functionality. Any bytes left over from the previous call
+        # (i.e. a message that had only partially arrived) are kept in front.
+        out = self._read(timeout)
+        self._rx_buf += out
+
+        if self._rx_partial and b"\r" not in out:
+            # Every message ends with a terminator, so a partial message at
+            # the head of the buffer cannot have completed yet. Avoid parsing
+            # it again.
+            return
+
+        if len(self._rx_buf) > 0:
+
+            # The buffer is processed left-to-right by advancing `start`, and
+            # only the consumed bytes are removed from it at the end.
+            buf = bytes(self._rx_buf)
+            parsers = self._parsers
+            start = 0
+            partial = False
+            # Every pass either advances `start` or breaks out, so the whole
+            # buffer is consumed in one call.
+            while len(buf) - start >= 4:
+                # Messages usually arrive back-to-back, in which case the next
+                # key sits right at the start of the buffer (possibly after
+                # the "\n" ending the previous message) and no search is
+                # needed. Each candidate key is sliced and looked up once.
+                msg_key = buf[start : start + 3]
+                parser = parsers.get(msg_key)
+                if parser is None:
+                    msg_key = buf[start + 1 : start + 4]
+                    parser = parsers.get(msg_key)
+                    if parser is not None:
+                        start += 1
+                if parser is None:
+                    # Find soonest recognized message key in a single pass.
+                    match = self._msg_key_regex.search(buf, start)
+                    if match is None:
+                        # No message start found. Only the last few bytes
+                        # could still be the start of a key yet to arrive.
+                        start = max(start, len(buf) - 3)
+                        break
+                    start = match.start()
+                    msg_key = match.group()
+                    parser = parsers[msg_key]
+
+                try:
+                    field_values, end_idx = parser(buf, start + 3)
+                except Exception:
+                    if buf.find(b"\r", start + 3) == -1:
+                        # Message has not fully arrived yet, keep it for the
+                        # next call.
+                        partial = True
+                        break
+
+                    start += 3
+                    if self.verbose:
+                        print("Message parsing error occured.")
+                        print(traceback.format_exc())
+                    continue
+
+                if end_idx < 0 or end_idx >= len(buf) - start - 3:
+                    # Message has not fully arrived yet, keep it for the next
+                    # call.
+                    partial = True
                     break
+
+                if self._threaded:
+                    self._response_container[msg_key] = field_values
+
+                    # Signal to main thread that a response is ready.
+                    self._response_events[msg_key].set()
+
+                    # Execute callbacks right away in this thread.
+                    self._execute_callbacks_guarded(msg_key, field_values)
+
                 else:
-                    # Go to next msg_idx
-                    temp = temp[next_msg_idx:]
-
-                    # Read first three characters, check if valid msg
-                    msg_key = temp[0:3]
-                    temp = temp[3:]
-                    if msg_key in self._r_format_dict:
-                        try:
-                            field_values, end_idx = self.packer.unpack(
-                                temp, self._r_format_dict[msg_key]
-                            )
-
-                            if self._threaded:
-                                # Lock main thread while response loaded.
-                                with self._response_condition:
-                                    self._response_container[msg_key] = field_values
-
-                                    # Signal to main thread that a response is
-                                    # ready.
-                                    self._response_condition.notify()
-
-                                # Put messages on a queue for callbacks.
-                                self._msg_queue.put((msg_key, field_values))
-                            
-                            else:
-                                self._response_container[msg_key] = field_values
-
-                                # Put messages on a queue for callbacks.
-                                self._msg_queue.append((msg_key, field_values))
-
-                            # Go to end of message.
-                            temp = temp[end_idx + 1 :]
-                        except Exception:
-                            if self.verbose:
-                                print("Message parsing error occured.")
-                                print(traceback.format_exc())
-
-                
+                    self._response_container[msg_key] = field_values
+
+                    # Put messages on a queue for callbacks.
+                    self._msg_queue.append((msg_key, field_values))
+
+                # Go to end of message.
+                start += 3 + end_idx + 1
+
+            del self._rx_buf[:start]
+            self._rx_partial = partial
 
     def _execute_callbacks(self, msg_key, field_values):
         # Check if any callbacks are registered for this specific msg
-        if msg_key in self._callbacks.keys():
-            cb_list = self._callbacks[msg_key]
-            for cb, cb_args in cb_list:
-                if cb_args is not None:
-                    cb(field_values, cb_args)
-                else:
-                    cb(field_values)
+        cb_list = self._callbacks.get(msg_key)
+        if cb_list:
+            for _, cb in cb_list:
+                cb(field_values)
+
+    def _execute_callbacks_guarded(self, msg_key, field_values):
+        # In the serial monitor thread, an exception raised by a callback
+        # would end the thread and leave every later command unanswered.
+        for _, cb in self._callbacks.get(msg_key, ()):
+            try:
+                cb(field_values)
+            except Exception:
+                print("Exception raised in a {0} callback.".format(msg_key))
+                print(traceback.format_exc())
 
     def _create_log_file(self):
         # Current date and time for logging
@@ -320,14 +451,45 @@ class UwbModule(object):
             "datasets/log_" + now + "_ID" + str(self.id) + ".txt"
         )
 
+        # Keep the file open for the lifetime of this module rather than
+        # re-opening it for every logged sample.
+        self._log_file = open(self._log_filename, "a", buffering=1 << 16)
+        self._log_flush_deadline = time.monotonic() + self._log_flush_interval
+
     def close(self):
         """
         Proper shutdown of this module. Note that even if the object does not
-        exist anymore in the main thread, the two internal threads will
+        exist anymore in the main thread, the internal thread will
         continue to exist unless this method is called or the main thread exits.
+
+        The internal thread is waited on before closing the serial port, which
+        can take up to one read timeout.
         """
 
         self._kill_monitor = True
+        if self._threaded:
+            self._monitor_thread.join()
+
+        self.device.close()
+
+        # The descriptor number may be reused by the OS for another file.
+        # Reading now goes through pyserial, which raises as the port is
+        # closed.
+        self._fd = None
+
+        # Deliver the last, partial batches.
+        for receiver in self._batch_receivers.values():
+            receiver.flush()
+
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
 
     def register_callback(self, msg_key: str, cb_function, callback_args=None):
         """
@@ -335,10 +497,18 @@ class UwbModule(object):
         message key is received over serial.
         """
         msg_key = msg_key.encode(self._encoding)
-        if msg_key in self._callbacks.keys():
-            self._callbacks[msg_key].append((cb_function, callback_args))
+
+        # Any arguments are bound here, so that dispatch is a single call
+        # with no branching. The original function is kept alongside for
+        # unregistering.
+        if callback_args is None:
+            dispatch = cb_function
         else:
-            self._callbacks[msg_key] = [(cb_function, callback_args)]
+
+            def dispatch(field_values):
+                return cb_function(field_values, callback_args)
+
+        self._callbacks[msg_key].append((cb_function, dispatch))
 
     def unregister_callback(self, msg_key: str, cb_function):
         """
@@ -346,7 +516,7 @@ class UwbModule(object):
         a specific message key.
         """
         msg_key = msg_key.encode(self._encoding)
-        if msg_key in self._callbacks.keys():
+        if msg_key in self._callbacks:
             funcs = [x[0] for x in self._callbacks[msg_key]]
             if cb_function in funcs:
                 idx = funcs.index(cb_function)
@@ -380,11 +550,19 @@ class UwbModule(object):
             data to be stored and printed
         """
         data = str(data)
-        if self._log_filename is None:
+        if self._log_file is None:
+            if not self.device.is_open:
+                raise RuntimeError("Cannot log to a closed UWB module.")
             self._create_log_file()
 
-        with open(self._log_filename, "a") as myfile:
-            myfile.write(data + "\n")
+        self._log_file.write(data + "\n")
+
+        # Lines are buffered, but flushed at least every flush interval so
+        # that little is lost if the process is killed.
+        now = time.monotonic()
+        if now >= self._log_flush_deadline:
+            self._log_file.flush()
+            self._log_flush_deadline = now + self._log_flush_interval
 
     def wait_for_messages(self, timeout=None):
         """
@@ -394,50 +572,43 @@ class UwbModule(object):
         or `timeout=None`, the default timeout will be used.
         """
         if not self._threaded:
-            
-            if timeout is not None:
-                old_timeout = self.device.timeout
-                self.device.timeout = timeout 
-
-            self._read_and_unpack()
+            self._read_and_unpack(timeout)
 
             # Execute any callbacks.
             while len(self._msg_queue) > 0:
-                msg_key, field_values = self._msg_queue.pop(0)
+                msg_key, field_values = self._msg_queue.popleft()
                 self._execute_callbacks(msg_key, field_values)
 
-            # Restore old read timeout
-            if timeout is not None:
-                self.device.timeout = old_timeout
-
-
     ############################################################################
     ########################## COMMAND IMPLEMENTATIONS #########################
     ############################################################################
-    def _execute_command(self, command_key: str, response_key: str, *args):
+    def _execute_command(
+        self, command_key: bytes, response_key: bytes, *args
+    ):
         """
         Executes an arbitrary command by command_key, and collects the response
-        based on response_key. 
+        based on response_key. Both keys are given already encoded, e.g. b"C01".
 
         Field values are passed as extra positional *args, which will be added
         to the message string that is sent to the firmware.
         """
-        command_key = command_key.encode(self._encoding)
-        response_key = response_key.encode(self._encoding)
-        msg = self.packer.pack(args, self._c_format_dict[command_key])
-        msg = command_key + msg
-        self._send(msg)
+        msg = self._command_packers[command_key](args)
 
         if self._threaded:
-            with self._response_condition:
-                self._response_container[response_key] = None
-                self._response_condition.wait(self.timeout)
-                response = self._response_container[response_key]
+            # The event must be cleared before sending, otherwise a fast
+            # response could be stored and then overwritten here.
+            event = self._response_events[response_key]
+            event.clear()
+            self._response_container[response_key] = None
+            self._send(msg)
+            event.wait(self.timeout)
+            response = self._response_container[response_key]
         else:
+            self._send(msg)
             self._response_container[response_key] = None
 
-            start_time = time.time()
-            while (time.time() - start_time) < self.timeout:
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
                 self._read_and_unpack()
                 response = self._response_container[response_key]
                 if response is not None:
@@ -445,7 +616,7 @@ class UwbModule(object):
 
             # Execute any callbacks.
             while len(self._msg_queue) > 0:
-                msg_key, field_values = self._msg_queue.pop(0)
+                msg_key, field_values = self._msg_queue.popleft()
                 self._execute_callbacks(msg_key, field_values)
 
         return response
@@ -458,8 +629,8 @@ class UwbModule(object):
         --------
         bool: successfully received response
         """
-        msg_key = "C00"
-        rsp_key = "R00"
+        msg_key = b"C00"
+        rsp_key = b"R00"
         response = self._execute_command(msg_key, rsp_key)
         if response is None:
             return False
@@ -478,8 +649,8 @@ class UwbModule(object):
             "is_valid": bool
                 whether the reported result is valid or an error occurred
         """
-        msg_key = "C01"
-        rsp_key = "R01"
+        msg_key = b"C01"
+        rsp_key = b"R01"
         response = self._execute_command(msg_key, rsp_key)
         if response is None:
             return {"id": None, "is_valid": False}
@@ -495,8 +666,8 @@ class UwbModule(object):
         --------
         bool: successfully received response
         """
-        msg_key = "C02"
-        rsp_key = "R02"
+        msg_key = b"C02"
+        rsp_key = b"R02"
         response = self._execute_command(msg_key, rsp_key)
         if response is None:
             return False
@@ -515,17 +686,15 @@ class UwbModule(object):
             is_valid: bool
                 whether the result is valid or some error occured
         """
-        msg_key = "C03"
-        rsp_key = "R03"
+        msg_key = b"C03"
+        rsp_key = b"R03"
 
-        test_dict = {"a": 3.14159, "b": [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]}
-        test_bytes = msgpack.packb(test_dict, use_single_float=True)
         test_fields = [
             12345,
             "the test string",
             True,
             1.2345,
-            test_bytes,
+            _TEST_PAYLOAD,
         ]
         response = self._execute_command(msg_key, rsp_key, *test_fields)
 
@@ -565,8 +734,8 @@ class UwbModule(object):
         --------
         bool: successfully received response
         """
-        msg_key = "C04"
-        rsp_key = "R04"
+        msg_key = b"C04"
+        rsp_key = b"R04"
         response = self._execute_command(msg_key, rsp_key, toggle)
         if response is None:
             return False
@@ -662,8 +831,8 @@ class UwbModule(object):
             skew2: float
                 the skew measurement for the second signal
         """
-        msg_key = "C05"
-        rsp_key = "R05"
+        msg_key = b"C05"
+        rsp_key = b"R05"
         response = self._execute_command(
             msg_key, rsp_key, target_id, meas_at_target, ds_twr, get_cir
         )
@@ -757,8 +926,8 @@ class UwbModule(object):
             "is_valid": bool
                 whether the reported result is valid or an error occurred
         """
-        msg_key = "C07"
-        rsp_key = "R07"
+        msg_key = b"C07"
+        rsp_key = b"R07"
         response = self._execute_command(msg_key, rsp_key)
         if response is False or response is None:
             return {"length": -1, "is_valid": False}
@@ -786,18 +955,18 @@ class UwbModule(object):
                     "Unable to detect the max supported UWB frame length."
                 )
 
-        msg_key = "C06"
-        rsp_key = "R06"
+        msg_key = b"C06"
+        rsp_key = b"R06"
 
         # add a small buffer to not hit max frame length exactly.
         frame_len = self._max_frame_len - 20
-        num_msg = int(len(data) / frame_len) + 1
-        frames = [
-            data[i : i + frame_len] for i in range(0, len(data), frame_len)
-        ]
+        num_msg = max((len(data) + frame_len - 1) // frame_len, 1)
+        view = memoryview(data)
 
-        for i, frame in enumerate(frames):
-            indexed_frame = struct.pack("<B", num_msg - i - 1) + frame
+        for i in range(num_msg):
+            frame = view[i * frame_len : (i + 1) * frame_len]
+            header = bytes((num_msg - i - 1,))
+            indexed_frame = b"".join((header, frame))
             response = self._execute_command(msg_key, rsp_key, indexed_frame)
 
         if response is None:
@@ -818,8 +987,8 @@ class UwbModule(object):
         --------
         bool: successfully received response
         """
-        msg_key = "C08"
-        rsp_key = "R08"
+        msg_key = b"C08"
+        rsp_key = b"R08"
         response = self._execute_command(msg_key, rsp_key, delay)
         if response is None:
             return False
@@ -832,32 +1001,67 @@ class UwbModule(object):
         non-ranging message is sent to this module.
         """
         # TODO: add callback_args
-        receiver = LongMessageReceiver(cb_function)
-        self._receivers[id(cb_function)] = receiver
+        receiver = LongMessageReceiver(cb_function, verbose=self.verbose)
+        self._receivers[cb_function] = receiver
         self.register_callback("S06", receiver.frame_callback)
 
+    def register_batch_callback(
+        self, msg_key: str, cb_function, callback_args=None, batch_size=100
+    ):
+        """
+        Registers a callback that gets called once for every `batch_size`
+        messages with a specific message key, rather than once per message.
+        Intended for high-rate streams such as passive listening.
+
+        The callback receives a list with one column per message field, each
+        column being a list of `batch_size` values in order of arrival. A
+        batch that is not full yet is delivered, shorter, when the callback
+        is unregistered or the module is closed.
+        """
+        num_fields = len(self._r_format_dict[msg_key.encode(self._encoding)])
+        receiver = BatchReceiver(
+            cb_function, num_fields, batch_size, callback_args
+        )
+        self._batch_receivers[(msg_key, cb_function)] = receiver
+        self.register_callback(msg_key, receiver.row_callback)
+
+    def unregister_batch_callback(self, msg_key: str, cb_function):
+        """
+        Unregister a previously-registered batch callback.
+        """
+        if (msg_key, cb_function) not in self._batch_receivers:
+            print("This callback is not registered.")
+            return
+
+        receiver = self._batch_receivers.pop((msg_key, cb_function))
+        self.unregister_callback(msg_key, receiver.row_callback)
+        receiver.flush()
+
     def unregister_message_callback(self, cb_function):
         """
         Unregister a previously-registered messaging callback.
         """
-        if not id(cb_function) in self._receivers.keys():
+        if cb_function not in self._receivers:
             print("This callback is not registered.")
+            return
 
-        receiver = self._receivers[id(cb_function)]
+        receiver = self._receivers.pop(cb_function)
         self.unregister_callback("S06", receiver.frame_callback)
 
 
 class LongMessageReceiver:
-    def __init__(self, cb_function) -> None:
-        self._long_msg = b""
+    def __init__(self, cb_function, verbose=False) -> None:
+        self._long_msg = bytearray()
         self._cb_function = cb_function
+        self._verbose = verbose
         self._exp_frames_remaining = None
 
     def frame_callback(self, msg):
         msg = msg[0]
-        frames_remaining = struct.unpack("<B", msg[0:1])[0]
-        print("GOT THE FOLLOWING: " + str(frames_remaining))
-        self._long_msg += msg[1:]
+        frames_remaining = msg[0]
+        if self._verbose:
+            print("Received frame, {0} remaining.".format(frames_remaining))
+        self._long_msg += memoryview(msg)[1:]
 
         is_valid = True
         if self._exp_frames_remaining is None:
@@ -869,6 +1073,50 @@ class LongMessageReceiver:
             self._exp_frames_remaining = frames_remaining
 
         if frames_remaining == 0:
-            self._cb_function(self._long_msg, is_valid)
-            self._long_msg = b""
+            self._cb_function(bytes(self._long_msg), is_valid)
+            self._long_msg.clear()
             self._exp_frames_remaining = None
+
+
+class BatchReceiver:
+    def __init__(self, cb_function, num_fields, batch_size, cb_args=None):
+        self._cb_function = cb_function
+        self._cb_args = cb_args
+        self._num_fields = num_fields
+        self._batch_size = batch_size
+        self._new_batch()
+
+    def _new_batch(self):
+        # Values are stored column-wise in preallocated lists.
+        self._columns = [
+            [None] * self._batch_size for _ in range(self._num_fields)
+        ]
+        self._idx = 0
+
+    def row_callback(self, field_values):
+        idx = self._idx
+        for column, value in zip(self._columns, field_values):
+            column[idx] = value
+        self._idx = idx + 1
+
+        if self._idx == self._batch_size:
+            columns = self._columns
+            self._new_batch()
+            self._deliver(columns)
+
+    def flush(self):
+        """
+        Delivers the messages received so far as a shorter batch, if any.
+        """
+        if self._idx == 0:
+            return
+
+        columns = [column[: self._idx] for column in self._columns]
+        self._new_batch()
+        self._deliver(columns)
+
+    def _deliver(self, columns):
+        if self._cb_args is not None:
+            self._cb_function(columns, self._cb_args)
+        else:
+            self._cb_function(columns)
@@ -0,0 +1,193 @@
+import os, pty
+import itertools
+import sys
+import termios
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(sys.path[0]))
+from pyuwb.uwbmodule import UwbModule, find_uwb_serial_ports
+
+"""
+Opening a pty and constructing a UwbModule on it (which waits for a reply
+to the initial get_id() call) dominates the runtime of the pty tests. The
+fixtures below share one pty and one UwbModule across a whole test module,
+and reset the module's state between tests instead.
+
+Tests pick the module configuration through indirect parametrization, e.g.
+@pytest.mark.parametrize("uwb", [{"threaded": True}], indirect=True)
+"""
+
+_UWB_DEFAULTS = {"timeout": 1, "verbose": False, "threaded": False}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--uwb-modules",
+        type=int,
+        default=3,
+        help="number of UWB modules to generate hardware tests for",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    # Modules, and ordered pairs of modules, are addressed by index so that
+    # each gets its own test id. Those beyond the connected modules are
+    # skipped.
+    indices = range(metafunc.config.getoption("uwb_modules"))
+    if "module" in metafunc.fixturenames:
+        metafunc.parametrize("module", indices, indirect=True)
+    if "module_pair" in metafunc.fixturenames:
+        pairs = list(itertools.permutations(indices, 2))
+        metafunc.parametrize(
+            "module_pair",
+            pairs,
+            ids=["{0}-{1}".format(*pair) for pair in pairs],
+            indirect=True,
+        )
+
+
+@pytest.fixture(scope="module")
+def pty_pair():
+    """
+    A pty shared by all tests in a module, as (device, port).
+    """
+    device, client = pty.openpty()
+    yield device, os.ttyname(client)
+    os.close(device)
+    os.close(client)
+
+
+@pytest.fixture
+def new_pty():
+    """
+    A pty for tests that need a UwbModule of their own, as (device, port).
+    """
+    device, client = pty.openpty()
+    yield device, os.ttyname(client)
+    os.close(device)
+    os.close(client)
+
+
+@pytest.fixture(scope="module")
+def _uwb_cache(pty_pair):
+    # Holds the module currently open on the shared pty, keyed on the
+    # settings that require it to be reconstructed.
+    cache = {}
+    yield cache
+    for uwb in cache.values():
+        uwb.close()
+
+
+@pytest.fixture
+def uwb(request, pty_pair, _uwb_cache):
+    """
+    A UwbModule on the shared pty, with a clean state for every test.
+    """
+    config = dict(_UWB_DEFAULTS, **getattr(request, "param", {}))
+    key = (config["verbose"], config["threaded"])
+
+    uwb = _uwb_cache.get(key)
+    if uwb is None:
+        # Only one module may read from the pty at a time.
+        for other in _uwb_cache.values():
+            other.close()
+        _uwb_cache.clear()
+
+        # Construct with a short timeout, as nothing will answer get_id().
+        uwb = UwbModule(
+            pty_pair[1],
+            timeout=0.1,
+            verbose=config["verbose"],
+            threaded=config["threaded"],
+        )
+        _uwb_cache[key] = uwb
+
+    uwb.timeout = config["timeout"]
+    uwb.device.timeout = config["timeout"]
+
+    # Discard anything left over from previous tests on both ends of the pty.
+    # Flushing the device side drops whatever the module sent, and resetting
+    # the module's input drops whatever a test wrote but it never read.
+    termios.tcflush(pty_pair[0], termios.TCIFLUSH)
+    uwb.device.reset_input_buffer()
+    uwb._rx_buf.clear()
+    uwb._rx_partial = False
+    uwb._max_frame_len = None
+    uwb._response_container.clear()
+    uwb._callbacks.clear()
+    uwb._receivers.clear()
+    uwb._batch_receivers.clear()
+    if config["threaded"]:
+        for event in uwb._response_events.values():
+            event.clear()
+    else:
+        uwb._msg_queue.clear()
+
+    return uwb
+
+
+@pytest.fixture(scope="session")
+def modules(request):
+    """
+    All UWB modules physically connected to this computer. They are only
+    searched for once a test asks for them, so collecting the suite or
+    running the pty tests never touches the serial ports. They are opened
+    with verbose off; set uwb.verbose inside a test to log its exchanges.
+    """
+    ports = find_uwb_serial_ports()
+
+    # Tests are only generated for the first --uwb-modules modules, so any
+    # others would silently go untested.
+    max_modules = request.config.getoption("uwb_modules")
+    if len(ports) > max_modules:
+        pytest.fail(
+            "{0} UWB modules are connected, but tests are only generated "
+            "for {1}. Run with --uwb-modules={0}.".format(
+                len(ports), max_modules
+            )
+        )
+
+    # Each constructor blocks on a get_id() round-trip, so open the modules
+    # in parallel.
+    with ThreadPoolExecutor(max_workers=max(len(ports), 1)) as executor:
+        modules = list(
+            executor.map(lambda port: UwbModule(port, verbose=False), ports)
+        )
+
+    yield modules
+    for uwb in modules:
+        uwb.close()
+
+
+@pytest.fixture(scope="session")
+def module_ids(modules):
+    """
+    The ID of each connected module, keyed on id(module), so that tests do
+    not need a get_id() round-trip every time they look up a neighbour.
+    """
+    return {id(uwb): uwb.get_id()["id"] for uwb in modules}
+
+
+@pytest.fixture
+def module(request, modules):
+    """
+    The connected module at index `request.param`, given through indirect
+    parametrization. Indices beyond the connected modules are skipped.
+    """
+    if request.param >= len(modules):
+        pytest.skip("Not enough modules are connected.")
+    return modules[request.param]
+
+
+@pytest.fixture
+def module_pair(request, modules):
+    """
+    The ordered pair of connected modules at the indices in
+    `request.param`, given through indirect parametrization. Pairs that are
+    not connected are skipped.
+    """
+    i, j = request.param
+    if max(i, j) >= len(modules):
+        pytest.skip("Not enough modules are connected for this pair.")
+    return modules[i], modules[j]
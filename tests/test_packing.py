@@ -29,5 +29,32 @@ def test_all_types():
     assert msg.split(packer._separator)[:3] == test_unpack.split(packer._separator)[:3]
 
 
+def test_compiled_unpacker():
+    test_types = [IntField, FloatField, StringField, IntField]
+    test_unpack = b"|42|3.5|hello|-7\r\nR01|1\r"
+
+    packer = Packer()
+    unpacker = packer.compile_unpacker(test_types)
+    assert unpacker(test_unpack) == packer.unpack(test_unpack, test_types)
+    assert unpacker(b"R05" + test_unpack, 3) == unpacker(test_unpack)
+    assert packer.compile_unpacker([])(b"\r\n") == packer.unpack(b"\r\n", [])
+
+
+def test_compiled_packer():
+    test_types = [IntField, StringField, BoolField, FloatField, ByteField]
+    test_values = [42, "hello", False, 3.5, b"\x00\r|"]
+
+    packer = Packer()
+    pack = packer.compile_packer(test_types, prefix=b"C99")
+    assert pack(test_values) == b"C99" + packer.pack(test_values, test_types)
+    assert packer.compile_packer([], prefix=b"C00")([]) == b"C00\r"
+
+
+def test_bool_field():
+    packer = Packer()
+    values_unpacked = packer.unpack(b"|0|1\r", [BoolField, BoolField])[0]
+    assert values_unpacked == [False, True]
+
+
 if __name__ == "__main__":
     test_all_types()
@@ -1,240 +1,242 @@
-import os, pty
+import io
+import os
+import select
 import sys
-from time import sleep
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import msgpack
+import pytest
+import serial
 import struct
 
 sys.path.append(os.path.dirname(sys.path[0]))
 from pyuwb.uwbmodule import UwbModule
 
-# device, client = pty.openpty()
-# port = os.ttyname(client)
+# Stimuli shared between tests, built once at import.
+_TWR_FRAME = b"S05|1|3.14159|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n"
+_CIR_FRAME = b"S10|0|1|2|3|" + b"0|" * 1016 + b"\r\n"
 
 
-def test_open():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port)
+def read_until(fd, terminator=b"\r", timeout=0.5):
+    """
+    Read what the module sent until `terminator` arrives, or until `timeout`
+    seconds pass, without blocking indefinitely.
+    """
+    buf = b""
+    deadline = time.monotonic() + timeout
+    while terminator not in buf:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            break
+        buf += os.read(fd, 4096)
+    return buf
+
+
+def reply_to_command(fd, response):
+    """
+    Wait for the module to send a command, then write `response` back.
+    Returns the command.
+    """
+    command = read_until(fd)
+    os.write(fd, response)
+    return command
 
 
-def test_write():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
+def test_open(new_pty):
+    device, port = new_pty
     uwb = UwbModule(port)
-    os.read(device, 1000)
-    my_string = "Hello to the uwb device"
-    uwb._send(my_string)
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == my_string
 
 
-def test_read():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1)
-    my_string = "I'm a virtual uwb device"
-    os.write(device, my_string.encode(uwb._encoding))
-    out = uwb._read()
-    print(out)
+def test_close(new_pty):
+    device, port = new_pty
+    with UwbModule(port) as uwb:
+        assert uwb.device.is_open
+    assert not uwb.device.is_open
 
 
-def test_monitor_thread():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=0.1, verbose=True, threaded=True)
-    my_string = "I'm a virtual uwb device\n"
-    os.write(device, my_string.encode(uwb._encoding))
-    sleep(1)
+def test_open_without_fileno(new_pty, monkeypatch):
+    # Non-POSIX pyserial backends inherit fileno() from io.RawIOBase.
+    def fileno(self):
+        raise io.UnsupportedOperation("fileno")
 
+    monkeypatch.setattr(serial.Serial, "fileno", fileno)
+    device, port = new_pty
+    with UwbModule(port) as uwb:
+        assert uwb._fd is None
 
-def test_set_idle():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R00\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    response = uwb.set_idle()
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C00\r"
-    assert response == True
 
+def test_read_after_close(new_pty):
+    device, port = new_pty
+    uwb = UwbModule(port)
+    uwb.close()
+
+    # The closed port's descriptor number is free to be reused by this pipe.
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, b"R01|4\r\n")
+        with pytest.raises(serial.SerialException):
+            uwb.wait_for_messages(0.1)
+        assert len(uwb._rx_buf) == 0
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_log_flush(new_pty, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "datasets").mkdir()
+    device, port = new_pty
+    with UwbModule(port) as uwb:
+        uwb._log_flush_interval = 0
+        uwb.log("sample")
+        with open(uwb._log_filename) as log_file:
+            assert log_file.read() == "sample\n"
+
+
+def test_log_after_close(new_pty):
+    device, port = new_pty
+    uwb = UwbModule(port)
+    uwb.close()
+    with pytest.raises(RuntimeError):
+        uwb.log("sample")
 
-def test_get_id():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R01|4\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    response = uwb.get_id()
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C01\r"
-    assert response["id"] == 4
-    assert response["is_valid"] == True
 
+def test_write(uwb, pty_pair):
+    device = pty_pair[0]
+    my_string = "Hello to the uwb device"
+    uwb._send(my_string)
+    out = read_until(device, terminator=b"device")
+    assert out.decode(uwb._encoding) == my_string
 
-#TODO: to be removed
-def test_get_id_threaded():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True, threaded=True)
-    os.read(device, 1000)
-    test_string = "R01|4\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    response = uwb.get_id()
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C01\r"
-    assert response["id"] == 4
-    assert response["is_valid"] == True
 
+def test_read(uwb, pty_pair):
+    device = pty_pair[0]
+    os.write(device, b"I'm a virtual uwb device")
+    out = uwb._read()
+    print(out)
 
-def test_get_id_err1():
-    """
-    Get ID when a different response is returned.
-    """
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    test_string = "R02\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    response = uwb.get_id()
-    assert response["id"] == None
-    assert response["is_valid"] is False
 
+@pytest.mark.parametrize(
+    "uwb", [{"timeout": 0.1, "threaded": True}], indirect=True
+)
+def test_monitor_thread(uwb, pty_pair):
+    device = pty_pair[0]
+    os.write(device, b"I'm a virtual uwb device\n")
 
-def test_get_id_err2():
-    """
-    Get ID when response is of incorrect format
-    """
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=2, verbose=True)
-    test_string = "R01\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    response = uwb.get_id()
-    assert response["id"] is None
-    assert response["is_valid"] == False
+    # A valid message after the junk shows the thread kept going.
+    os.write(device, b"R01|4\r\n")
+    assert uwb._response_events[b"R01"].wait(1)
 
 
-def test_get_id_no_response():
-    """
-    Get ID when no response is returned.
-    """
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    response = uwb.get_id()
-    assert response["id"] == None
-    assert response["is_valid"] is False
-
-
-def test_get_id_multiple_response():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R05|0\r\nR01|32\r\nR00\r\nR02|1\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    response = uwb.get_id()
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C01\r"
-    assert response["id"] == 32
-    assert response["is_valid"] == True
+def test_set_idle(uwb, pty_pair):
+    device = pty_pair[0]
+    os.write(device, b"R00\r\n")
+    response = uwb.set_idle()
+    out = read_until(device)
+    assert out == b"C00\r"
+    assert response == True
 
 
-def test_reset():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R02\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
+@pytest.mark.parametrize(
+    "stimulus,expected_id,is_valid",
+    [
+        (b"R01|4\r\n", 4, True),
+        # A different response is returned.
+        (b"R02\r\n", None, False),
+        # The response is of incorrect format.
+        (b"R01\r\n", None, False),
+        # No response is returned.
+        (b"", None, False),
+        (b"R05|0\r\nR01|32\r\nR00\r\nR02|1\r\n", 32, True),
+    ],
+    ids=["ok", "err1", "err2", "no_response", "multiple"],
+)
+def test_get_id(uwb, pty_pair, stimulus, expected_id, is_valid):
+    device = pty_pair[0]
+
+    # Only answer once the command has been sent, like the firmware would.
+    # Answering ahead of time races the monitor thread in threaded mode,
+    # which may store the response before get_id() has cleared it.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(reply_to_command, device, stimulus)
+        response = uwb.get_id()
+    out = future.result()
+    assert out == b"C01\r"
+    assert response["id"] == expected_id
+    assert response["is_valid"] == is_valid
+
+
+def test_reset(uwb, pty_pair):
+    device = pty_pair[0]
+    os.write(device, b"R02\r\n")
     response = uwb.reset()
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C02\r"
+    out = read_until(device)
+    assert out == b"C02\r"
     assert response == True
 
 
-def test_firmware_tests():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
+@pytest.mark.parametrize("uwb", [{"timeout": 10}], indirect=True)
+def test_firmware_tests(uwb, pty_pair):
+    device = pty_pair[0]
     test_string = (
         b"R03|0|12345|the test string|1|1.2345|"
         b"+\x00\x82\xa1a\xca@I\x0f\xd0\xa1b\x92\x93\xca?\x80\x00\x00\xca@\x00"
         b"\x00\x00\xca@@\x00\x00\x93\xca@\x80\x00\x00\xca@\xa0\x00\x00\xca@"
         b"\xc0\x00\x00\r\n"
     )
-    uwb = UwbModule(port, timeout=10, verbose=True)
     os.write(device, test_string)
     data = uwb.do_tests()
-    sleep(0.1)
     assert data["is_valid"]
     assert data["parsing_test"] == True
 
 
-def test_toggle_passive():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R04\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
+def test_toggle_passive(uwb, pty_pair):
+    device = pty_pair[0]
+    os.write(device, b"R04\r\n")
     response = uwb.toggle_passive(True)
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C04|1\r"
+    out = read_until(device)
+    assert out == b"C04|1\r"
     assert response == True
 
 
-def test_do_twr():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R05|1|3.14159|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    response = uwb.do_twr(target_id=1)
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C05|1|0|0|0\r"
-    assert response["range"] == 3.14159
-    assert response["is_valid"] == True
-
-
-def test_twr_err1():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    test_string = "R05|3.14159abc\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
+@pytest.mark.parametrize(
+    "stimulus,expected_range,is_valid",
+    [
+        (b"R05|1|3.14159|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n", 3.14159, True),
+        (b"R05|3.14159abc\r\n", 0.0, False),
+    ],
+    ids=["ok", "err1"],
+)
+def test_do_twr(uwb, pty_pair, stimulus, expected_range, is_valid):
+    device = pty_pair[0]
+    os.write(device, stimulus)
     response = uwb.do_twr(target_id=1)
-    assert response["range"] == 0.0
-    assert response["is_valid"] == False
+    out = read_until(device)
+    assert out == b"C05|1|0|0|0\r"
+    assert response["range"] == expected_range
+    assert response["is_valid"] == is_valid
 
 
-def test_get_max_frame_length():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R07|100\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
+def test_get_max_frame_length(uwb, pty_pair):
+    device = pty_pair[0]
+    os.write(device, b"R07|100\r\n")
     response = uwb.get_max_frame_length()
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C07\r"
+    out = read_until(device)
+    assert out == b"C07\r"
     assert response["length"] == 100
     assert response["is_valid"] == True
 
 
-def test_set_response_delay():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
-    test_string = "R08\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
+def test_set_response_delay(uwb, pty_pair):
+    device = pty_pair[0]
+    os.write(device, b"R08\r\n")
     response = uwb.set_response_delay(5000)
-    out = os.read(device, 1000)
-    assert out.decode(uwb._encoding) == "C08|5000\r"
+    out = read_until(device)
+    assert out == b"C08|5000\r"
     assert response == True
 
 
@@ -248,60 +250,171 @@ thread and the main thread.
 class DummyCallbackTracker:
     def __init__(self):
         self.entered_cb = False
+        self.done = threading.Event()
 
     def dummy_callback(self, *args):
         self.entered_cb = True
+        self.args = args
+        self.done.set()
+
+
+def test_twr_callback_args(uwb, pty_pair):
+    device = pty_pair[0]
+    tracker = DummyCallbackTracker()
+    uwb.register_callback("S05", tracker.dummy_callback, "extra")
+    os.write(device, _TWR_FRAME)
+    uwb.wait_for_messages(0.1)
+    assert tracker.entered_cb == True
+    assert tracker.args[1] == "extra"
 
 
-def test_twr_callback():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
+def test_message_burst(uwb):
+    # Everything already received is dispatched in a single call, however
+    # many messages that is.
+    calls = []
+    uwb.register_callback("S05", calls.append)
+    uwb._rx_buf += _TWR_FRAME * 150
+    uwb.wait_for_messages(0)
+    assert len(calls) == 150
+
+
+def test_split_message(uwb, pty_pair):
+    device = pty_pair[0]
     tracker = DummyCallbackTracker()
-    uwb = UwbModule(port, timeout=1, verbose=True, threaded=False)
-    os.read(device, 1000)
     uwb.register_callback("S05", tracker.dummy_callback)
-    test_string = "S05|1|3.14159|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
+    os.write(device, b"S05|1|3.14159|0|0|0|0|0")
+    uwb.wait_for_messages(0.1)
+    assert tracker.entered_cb == False
+    os.write(device, b"|0|0.0|0.0|0.0|0.0\r\n")
     uwb.wait_for_messages(0.1)
     assert tracker.entered_cb == True
 
 
-#TODO: to be removed
-def test_twr_callback_threaded():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
+def test_read_without_fd(uwb, pty_pair, monkeypatch):
+    # Use the pyserial read path taken when the port has no file descriptor.
+    monkeypatch.setattr(uwb, "_fd", None)
+    device = pty_pair[0]
     tracker = DummyCallbackTracker()
-    uwb = UwbModule(port, timeout=1, verbose=True, threaded=True)
-    os.read(device, 1000)
     uwb.register_callback("S05", tracker.dummy_callback)
-    test_string = "S05|1|3.14159|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    sleep(0.1)
+    os.write(device, _TWR_FRAME)
+    uwb.wait_for_messages(0.1)
     assert tracker.entered_cb == True
+    assert uwb.device.timeout == 1
 
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(reply_to_command, device, b"R01|4\r\n")
+        response = uwb.get_id()
+    assert future.result() == b"C01\r"
+    assert response["id"] == 4
 
-def test_twr_callback_unregister():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
+
+# TODO: threaded case to be removed along with the threaded backend.
+@pytest.mark.parametrize(
+    "uwb", [{}, {"threaded": True}], ids=["default", "threaded"], indirect=True
+)
+def test_twr_callback(uwb, pty_pair):
+    device = pty_pair[0]
+    tracker = DummyCallbackTracker()
+    uwb.register_callback("S05", tracker.dummy_callback)
+    os.write(device, _TWR_FRAME)
+
+    # Dispatches the callback in the default backend, and returns right away
+    # in the threaded one where the monitor thread does it.
+    uwb.wait_for_messages(0.1)
+    assert tracker.done.wait(0.5)
+
+
+@pytest.mark.parametrize("uwb", [{"threaded": True}], indirect=True)
+def test_twr_callback_unregister(uwb, pty_pair):
+    device = pty_pair[0]
     tracker = DummyCallbackTracker()
-    uwb = UwbModule(port, timeout=1, verbose=True, threaded=True)
     uwb.register_callback("R05", tracker.dummy_callback)
     uwb.unregister_callback("R05", tracker.dummy_callback)
-    test_string = "R05|1|3.14159|0|0|0|0|0|0|0.0|0.0\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
-    sleep(0.1)
-    assert tracker.entered_cb == False
+    os.write(device, b"R05|1|3.14159|0|0|0|0|0|0|0.0|0.0\r\n")
+    assert not tracker.done.wait(0.05)
+
+
+# TODO: to be removed along with the threaded backend. Kept next to the other
+# threaded tests, so the shared module is only rebuilt once for them.
+@pytest.mark.parametrize("uwb", [{"threaded": True}], indirect=True)
+def test_get_id_threaded(uwb, pty_pair):
+    device = pty_pair[0]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(reply_to_command, device, b"R01|4\r\n")
+        response = uwb.get_id()
+    assert future.result() == b"C01\r"
+    assert response["id"] == 4
+    assert response["is_valid"]
+
 
+@pytest.mark.parametrize("uwb", [{"threaded": True}], indirect=True)
+def test_callback_exception_threaded(uwb, pty_pair):
+    device = pty_pair[0]
 
-def test_cir_callback():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
+    def raising_callback(field_values):
+        raise ValueError("error in user code")
+
+    uwb.register_callback("S05", raising_callback)
+    os.write(device, _TWR_FRAME)
+
+    # The monitor thread survives and still answers commands.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(reply_to_command, device, b"R01|4\r\n")
+        response = uwb.get_id()
+    assert future.result() == b"C01\r"
+    assert response["is_valid"]
+
+
+class BatchTracker:
+    def __init__(self):
+        self.batches = []
+
+    def callback(self, columns):
+        self.batches.append(columns)
+
+
+def test_batch_callback(uwb, pty_pair):
+    device = pty_pair[0]
+    tracker = BatchTracker()
+    uwb.register_batch_callback("S05", tracker.callback, batch_size=2)
+    os.write(
+        device,
+        b"S05|1|3.14159|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n"
+        b"S05|2|2.71828|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n"
+        b"S05|3|1.41421|0|0|0|0|0|0|0.0|0.0|0.0|0.0\r\n",
+    )
+    uwb.wait_for_messages(0.1)
+    assert len(tracker.batches) == 1
+    assert tracker.batches[0][0] == [1, 2]
+    assert tracker.batches[0][1] == [3.14159, 2.71828]
+
+    # The last, partial batch is delivered on unregistering.
+    uwb.unregister_batch_callback("S05", tracker.callback)
+    assert len(tracker.batches) == 2
+    assert tracker.batches[1][0] == [3]
+
+
+def test_batch_callback_two_keys(uwb, pty_pair):
+    device = pty_pair[0]
+    tracker = BatchTracker()
+    uwb.register_batch_callback("S05", tracker.callback, batch_size=2)
+    uwb.register_batch_callback("R05", tracker.callback, batch_size=2)
+    os.write(device, _TWR_FRAME + _TWR_FRAME.replace(b"S05|1", b"R05|2"))
+    uwb.wait_for_messages(0.1)
+
+    # Each key keeps its own batch, delivered when it is unregistered.
+    uwb.unregister_batch_callback("S05", tracker.callback)
+    uwb.unregister_batch_callback("R05", tracker.callback)
+    assert [batch[0] for batch in tracker.batches] == [[1], [2]]
+    assert not uwb._callbacks[b"S05"]
+    assert not uwb._callbacks[b"R05"]
+
+
+def test_cir_callback(uwb, pty_pair):
+    device = pty_pair[0]
     tracker = DummyCallbackTracker()
-    uwb = UwbModule(port, timeout=1, verbose=True)
-    os.read(device, 1000)
     uwb.register_callback("S10", tracker.dummy_callback)
-    test_string = "S10|0|1|2|3|" + "0|"*1016 + "\r\n"
-    os.write(device, test_string.encode(uwb._encoding))
+    os.write(device, _CIR_FRAME)
     uwb.wait_for_messages(0.1)
     assert tracker.entered_cb == True
 
@@ -311,9 +424,8 @@ class MessageTracker:
         self.msg = msg
 
 
-def test_long_message():
-    device, client = pty.openpty()
-    port = os.ttyname(client)
+def test_long_message(uwb, pty_pair):
+    device = pty_pair[0]
 
     test_msg = {
         "t": 3.14159,
@@ -324,28 +436,60 @@ def test_long_message():
 
     max_frame_len = 100
     tracker = MessageTracker()
-    uwb = UwbModule(port, timeout=1, verbose=True)
     uwb.register_message_callback(tracker.callback)
     uwb._max_frame_len = 100
 
     frame_len = max_frame_len - 20
-    num_msg = int(len(data) / frame_len) + 1
-    frames = [data[i : i + frame_len] for i in range(0, len(data), frame_len)]
+    num_msg = (len(data) + frame_len - 1) // frame_len
+
+    # Each S06 message is the key, a 2-byte length, the frame index, the
+    # frame itself and the terminator. They are all written into one
+    # preallocated buffer and sent with a single write.
+    header = struct.Struct("<4sHB")
+    view = memoryview(data)
+    buf = bytearray(num_msg * (header.size + 2) + len(data))
+    offset = 0
+    for i in range(num_msg):
+        frame = view[i * frame_len : (i + 1) * frame_len]
+        header.pack_into(buf, offset, b"S06|", len(frame) + 1, num_msg - i - 1)
+        offset += header.size
+        buf[offset : offset + len(frame)] = frame
+        offset += len(frame)
+        buf[offset : offset + 2] = b"\r\n"
+        offset += 2
+    os.write(device, buf)
+
+    uwb.broadcast(data)
+    assert tracker.msg == data
+
+
+def test_message_callback_unregister(uwb):
+    tracker = MessageTracker()
+    uwb.register_message_callback(tracker.callback)
+    uwb.unregister_message_callback(tracker.callback)
+    assert not uwb._receivers
+    assert not uwb._callbacks[b"S06"]
+
 
-    indexed_frames = []
-    for i, frame in enumerate(frames):
-        indexed_frames.append(struct.pack("<B", num_msg - i - 1) + frame)
+@pytest.mark.parametrize("uwb", [{"timeout": 0.1}], indirect=True)
+def test_broadcast_exact_multiple(uwb, pty_pair):
+    device = pty_pair[0]
 
-    responses = [
-        b"S06|" + struct.pack("<H", len(frame)) + frame + b"\r\n"
-        for frame in indexed_frames
-    ]
-    for response in responses:
-        os.write(device, response)
+    uwb._max_frame_len = 100
 
+    # Two full frames of 80 bytes each, with no trailing empty frame.
+    data = b"\x00" * 160
     uwb.broadcast(data)
-    assert tracker.msg == data
 
+    # Collect both commands, without hanging if fewer were sent.
+    out = b""
+    while out.count(b"\r") < 2:
+        chunk = read_until(device)
+        if not chunk:
+            break
+        out += chunk
+
+    # Each command is "C06|", a 2-byte length, then the frame index.
+    indices = [frame[2] for frame in out.split(b"C06|")[1:]]
+    assert indices == [1, 0]
 
-if __name__ == "__main__":
-    test_twr_callback()
@@ -1,8 +1,7 @@
-from random import random
-from pyuwb.uwbmodule import UwbModule, find_uwb_serial_ports
 import itertools
+import threading
 import pytest
-from time import sleep
+from time import sleep, monotonic
 import msgpack
 
 """ 
@@ -10,257 +9,177 @@ Most of these tests require a minimum of two modules physically
 connected to the computer, with some requiring three.
 """
 
-ports = find_uwb_serial_ports()
-modules = [UwbModule(port, verbose=True) for port in ports]
-
-
-def test_get_id():
-    if len(modules) < 1:
-        pytest.skip("At least one module needs to be connected.")
-
-    for uwb in modules:
-        data = uwb.get_id()
-        assert data["is_valid"]
-
-
-def test_firmware_tests():
-    if len(modules) < 1:
-        pytest.skip("At least one module needs to be connected.")
-
-    for uwb in modules:
-        data = uwb.do_tests()
-        assert data["is_valid"]
-        assert data["parsing_test"] == True
-
-
-def test_twr():
-    if len(modules) < 2:
-        pytest.skip("At least two modules need to be connected.")
-
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=False,
-            ds_twr=False,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
-
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=True,
-            ds_twr=False,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
-
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=False,
-            ds_twr=True,
-            get_cir=True,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
-
-
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=True,
-            ds_twr=True,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
-
-
-def test_twr_w_cir():
-    if len(modules) < 2:
-        pytest.skip("At least two modules need to be connected.")
+# Broadcast payloads, packed once at import. The second spans several frames.
+_MSGPACK_MSG = msgpack.packb(
+    {
+        "t": 3.14159,
+        "x": [1, 2, 3],
+        "P": [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+    }
+)
+_LONG_MSG = msgpack.packb(
+    {
+        "t": 3.14159,
+        "x": [1.0] * 15,
+        "P": [[0.5] * i for i in range(1, 15 + 1)],
+    }
+)
+
+def _ok(range_data, only_range=False):
+    """
+    Whether a do_twr() result is valid and its measurements are nonzero.
+    Assert on it with the result as the message, so that a failure shows
+    every field at once.
+    """
+    if only_range:
+        return range_data["is_valid"] and range_data["range"] != 0.0
+    return (
+        range_data["is_valid"]
+        and range_data["range"] != 0.0
+        and range_data["tx1"] != 0.0
+        and range_data["fpp1"] != 0.0
+        and range_data["skew1"] != 0.0
+    )
 
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=False,
-            ds_twr=False,
-            get_cir=True,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
 
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=True,
-            ds_twr=False,
-            get_cir=True,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
+def test_get_id(module):
+    data = module.get_id()
+    assert data["is_valid"]
 
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=False,
-            ds_twr=True,
-            get_cir=True,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
 
-    for (uwb1, uwb2) in itertools.permutations(modules, 2):
-        sleep(0.01)
-        neighbor_id = uwb2.get_id()["id"]
-        sleep(0.01)
-        range_data = uwb1.do_twr(
-            target_id=neighbor_id,
-            meas_at_target=True,
-            ds_twr=True,
-            get_cir=True,
-        )
-        assert range_data["neighbour"] == neighbor_id
-        assert range_data["range"] != 0.0
-        assert range_data["tx1"] != 0.0
-        assert range_data["fpp1"] != 0.0
-        assert range_data["skew1"] != 0.0
-        assert range_data["is_valid"]
+def test_firmware_tests(module):
+    data = module.do_tests()
+    assert data["is_valid"]
+    assert data["parsing_test"] == True
 
 
-def test_get_max_frame_len():
-    if len(modules) < 1:
-        pytest.skip("At least one module needs to be connected.")
+@pytest.mark.parametrize(
+    "meas_at_target,ds_twr,get_cir",
+    list(itertools.product([False, True], repeat=3)),
+)
+def test_twr(module_pair, module_ids, meas_at_target, ds_twr, get_cir):
+    uwb1, uwb2 = module_pair
+    neighbor_id = module_ids[id(uwb2)]
+    range_data = uwb1.do_twr(
+        target_id=neighbor_id,
+        meas_at_target=meas_at_target,
+        ds_twr=ds_twr,
+        get_cir=get_cir,
+    )
+    assert _ok(range_data), range_data
+    assert range_data["neighbour"] == neighbor_id
 
-    for uwb in modules:
-        data = uwb.get_max_frame_length()
-        print(data)
-        assert data["is_valid"]
 
+def test_get_max_frame_len(module):
+    data = module.get_max_frame_length()
+    print(data)
+    assert data["is_valid"]
 
-def test_set_response_delay():
-    if len(modules) < 1:
-        pytest.skip("At least one module needs to be connected.")
 
-    for uwb in modules:
-        data = uwb.set_response_delay()
-        assert data
+def test_set_response_delay(module):
+    data = module.set_response_delay()
+    assert data
 
 
 class DummyCallbackTracker(object):
     def __init__(self):
         self.num_called = 0
+        self.registrations = []
 
     def dummy_callback(self, *args):
         self.num_called += 1
 
+    def attach(self, uwb, msg_key):
+        uwb.register_callback(msg_key, self.dummy_callback)
+        self.registrations.append((uwb, msg_key))
+
+    def reset(self):
+        self.num_called = 0
+
 
-def test_twr_callback():
+@pytest.fixture
+def tracker():
+    """
+    A fresh DummyCallbackTracker. Callbacks registered through its attach()
+    method are unregistered once the test ends, so they do not pile up on
+    the shared modules.
+    """
+    tracker = DummyCallbackTracker()
+    yield tracker
+    for uwb, msg_key in tracker.registrations:
+        uwb.unregister_callback(msg_key, tracker.dummy_callback)
+
+
+def wait_for_calls(uwb, tracker, expected, timeout=1.0):
+    """
+    Process incoming messages on `uwb` until `tracker` has been called
+    `expected` times, or until `timeout` seconds pass.
+    """
+    deadline = monotonic() + timeout
+    while tracker.num_called < expected and monotonic() < deadline:
+        uwb.wait_for_messages()
+
+
+def test_twr_callback(modules, module_ids, tracker):
     if len(modules) < 2:
         pytest.skip("At least two modules need to be connected.")
 
     uwb1 = modules[0]
-    uwb1.verbose = False
     uwb2 = modules[1]
-    neighbor_id = uwb2.get_id()["id"]
-    tracker = DummyCallbackTracker()
-    uwb2.register_callback("S05", tracker.dummy_callback)
+    neighbor_id = module_ids[id(uwb2)]
+    tracker.attach(uwb2, "S05")
 
     # TODO: message prefixes are not meant to be user-facing
+    # Range back-to-back, and let uwb2's reports queue up on its serial port
+    # until they are all processed at the end.
     N = 10
     for i in range(N):
         range_data = uwb1.do_twr(
-            target_id=neighbor_id, meas_at_target=True, ds_twr=False
+            target_id=neighbor_id,
+            meas_at_target=True,
+            ds_twr=False,
+            only_range=True,
         )
         assert range_data["is_valid"]
-        uwb2.wait_for_messages()
-    sleep(0.1)
+    wait_for_calls(uwb2, tracker, N)
     assert tracker.num_called == N
 
 
-def test_ds_twr_callback():
+def test_ds_twr_callback(modules, module_ids, tracker):
     if len(modules) < 2:
         pytest.skip("At least two modules need to be connected.")
 
     uwb1 = modules[0]
-    uwb1.verbose = False
     uwb2 = modules[1]
-    neighbor_id = uwb2.get_id()["id"]
-    tracker = DummyCallbackTracker()
-    uwb2.register_callback("S05", tracker.dummy_callback)
+    neighbor_id = module_ids[id(uwb2)]
+    tracker.attach(uwb2, "S05")
 
     # TODO: message prefixes are not meant to be user-facing
+    # Range back-to-back, and let uwb2's reports queue up on its serial port
+    # until they are all processed at the end.
     N = 10
     for i in range(N):
         range_data = uwb1.do_twr(
-            target_id=neighbor_id, meas_at_target=True, ds_twr=True
+            target_id=neighbor_id,
+            meas_at_target=True,
+            ds_twr=True,
+            only_range=True,
         )
         assert range_data["is_valid"]
-        uwb2.wait_for_messages()
-    sleep(0.1)
+    wait_for_calls(uwb2, tracker, N)
     assert tracker.num_called == N
 
 
-def test_passive_listening():
+def test_passive_listening(modules, module_ids, tracker):
     if len(modules) < 3:
         pytest.skip("At least three modules need to be connected.")
 
     uwb1 = modules[0]
-    uwb1.verbose = False
     uwb2 = modules[1]
     uwb3 = modules[2]
-    neighbor_id = uwb2.get_id()["id"]
-    tracker = DummyCallbackTracker()
-    uwb3.register_listening_callback(tracker.dummy_callback)
+    neighbor_id = module_ids[id(uwb2)]
+    # Passive listening reports arrive as S01 messages.
+    tracker.attach(uwb3, "S01")
 
     uwb3.set_passive_listening()
     sleep(0.1)
@@ -268,56 +187,64 @@ def test_passive_listening():
     N = 5
     for _ in range(N):
         range_data = uwb1.do_twr(
-            target_id=neighbor_id, meas_at_target=True, ds_twr=True
+            target_id=neighbor_id,
+            meas_at_target=True,
+            ds_twr=True,
+            only_range=True,
         )
-        assert range_data["range"] != 0.0
-        assert range_data["is_valid"]
+        assert _ok(range_data, only_range=True), range_data
         uwb3.wait_for_messages()
-    sleep(0.1)
+    wait_for_calls(uwb3, tracker, N)
     assert tracker.num_called == N
+    tracker.reset()
 
     for _ in range(N):
         range_data = uwb1.do_twr(
-            target_id=neighbor_id, meas_at_target=False, ds_twr=True
+            target_id=neighbor_id,
+            meas_at_target=False,
+            ds_twr=True,
+            only_range=True,
         )
-        assert range_data["range"] != 0.0
-        assert range_data["is_valid"]
+        assert _ok(range_data, only_range=True), range_data
         uwb3.wait_for_messages()
-    sleep(0.1)
-    assert tracker.num_called == 2 * N
+    wait_for_calls(uwb3, tracker, N)
+    assert tracker.num_called == N
+    tracker.reset()
 
     for _ in range(N):
         range_data = uwb1.do_twr(
-            target_id=neighbor_id, meas_at_target=True, ds_twr=False
+            target_id=neighbor_id,
+            meas_at_target=True,
+            ds_twr=False,
+            only_range=True,
         )
-        assert range_data["range"] != 0.0
-        assert range_data["is_valid"]
+        assert _ok(range_data, only_range=True), range_data
         uwb3.wait_for_messages()
-        sleep(0.01)
-    sleep(0.1)
-    assert tracker.num_called == 3 * N
+    wait_for_calls(uwb3, tracker, N)
+    assert tracker.num_called == N
+    tracker.reset()
 
     for _ in range(N):
         range_data = uwb1.do_twr(
-            target_id=neighbor_id, meas_at_target=False, ds_twr=False
+            target_id=neighbor_id,
+            meas_at_target=False,
+            ds_twr=False,
+            only_range=True,
         )
-        assert range_data["range"] != 0.0
-        assert range_data["is_valid"]
+        assert _ok(range_data, only_range=True), range_data
         uwb3.wait_for_messages()
-    sleep(0.1)
-    assert tracker.num_called == 4 * N
+    wait_for_calls(uwb3, tracker, N)
+    assert tracker.num_called == N
 
 
-def test_cir_callback():
+def test_cir_callback(modules, module_ids, tracker):
     if len(modules) < 2:
         pytest.skip("At least two modules need to be connected.")
 
     uwb1 = modules[0]
-    uwb1.verbose = False
     uwb2 = modules[1]
-    neighbor_id = uwb2.get_id()["id"]
-    tracker = DummyCallbackTracker()
-    uwb2.register_callback("S10", tracker.dummy_callback)
+    neighbor_id = module_ids[id(uwb2)]
+    tracker.attach(uwb2, "S10")
 
     range_data = uwb1.do_twr(
         target_id=neighbor_id, 
@@ -326,127 +253,80 @@ def test_cir_callback():
         get_cir=True,
     )
     assert range_data["is_valid"]
-    uwb2.wait_for_messages()
-    sleep(0.1)
+    wait_for_calls(uwb2, tracker, 1)
     assert tracker.num_called == 1
 
 
 class MessageTracker:
+    def __init__(self):
+        self.msg = None
+        self.received = threading.Event()
+        self.registrations = []
+
     def callback(self, msg, is_valid):
         self.msg = msg
-
-
-def test_broadcast():
-    if len(modules) < 2:
-        pytest.skip("At least two modules need to be connected.")
-
-    trackers = [MessageTracker() for uwb in modules[1:]]
-
-    for i, uwb in enumerate(modules[1:]):
-        uwb.register_message_callback(trackers[i].callback)
-
-    test_msg = b"test\0\r\n|message"
-    modules[0].broadcast(test_msg)
-    
-    for i, uwb in enumerate(modules[1:]):
-        uwb.wait_for_messages()
-
+        self.received.set()
+
+    def attach(self, uwb):
+        uwb.register_message_callback(self.callback)
+        self.registrations.append(uwb)
+
+
+@pytest.fixture
+def message_trackers(modules):
+    """
+    One MessageTracker attached to each module but the first, as receivers
+    of a broadcast. They are detached once the test ends.
+    """
+    trackers = []
+    for uwb in modules[1:]:
+        tracker = MessageTracker()
+        tracker.attach(uwb)
+        trackers.append(tracker)
+    yield trackers
     for tracker in trackers:
-        assert tracker.msg == test_msg
+        for uwb in tracker.registrations:
+            uwb.unregister_message_callback(tracker.callback)
 
 
-def test_broadcast_msgpack():
-    if len(modules) < 2:
-        pytest.skip("At least two modules need to be connected.")
-
-    trackers = [MessageTracker() for uwb in modules[1:]]
-
-    for i, uwb in enumerate(modules[1:]):
-        uwb.register_message_callback(trackers[i].callback)
-
-    test_msg = {
-        "t": 3.14159,
-        "x": [1, 2, 3],
-        "P": [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
-    }
-    data = msgpack.packb(test_msg)
-    modules[0].broadcast(data)
-    
-    for i, uwb in enumerate(modules[1:]):
+def wait_for_message(uwb, tracker, timeout=1.0):
+    """
+    Process incoming messages on `uwb` until `tracker` has received a full
+    message, or until `timeout` seconds pass.
+    """
+    deadline = monotonic() + timeout
+    while not tracker.received.is_set() and monotonic() < deadline:
         uwb.wait_for_messages()
-
-    for tracker in trackers:
-        assert msgpack.unpackb(tracker.msg) == test_msg
-
-
-class LongMessageTracker:
-    def callback(self, msg, is_valid):
-        self.msg = msg
+    return tracker.received.is_set()
 
 
-def test_message_callback():
+@pytest.mark.parametrize(
+    "data",
+    [b"test\0\r\n|message", _MSGPACK_MSG, _LONG_MSG],
+    ids=["bytes", "msgpack", "long"],
+)
+def test_broadcast(modules, message_trackers, data):
     if len(modules) < 2:
         pytest.skip("At least two modules need to be connected.")
 
-    trackers = [LongMessageTracker() for uwb in modules[1:]]
-
-    for i, uwb in enumerate(modules[1:]):
-        uwb.register_message_callback(trackers[i].callback)
-
-    test_msg = {
-        "t": 3.14159,
-        "x": [1, 2, 3],
-        "P": [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
-    }
-    data = msgpack.packb(test_msg)
     modules[0].broadcast(data)
-    
-    for i, uwb in enumerate(modules[1:]):
-        uwb.wait_for_messages()
 
-    for tracker in trackers:
-        assert msgpack.unpackb(tracker.msg) == test_msg
+    # A long message spans several frames, which may not all arrive in a
+    # single read.
+    for uwb, tracker in zip(modules[1:], message_trackers):
+        assert wait_for_message(uwb, tracker)
 
+    for tracker in message_trackers:
+        assert tracker.msg == data
 
-def test_long_message():
-    if len(modules) < 2:
-        pytest.skip("At least two modules need to be connected.")
-
-    trackers = [LongMessageTracker() for uwb in modules[1:]]
 
-    for i, uwb in enumerate(modules[1:]):
-        uwb.register_message_callback(trackers[i].callback)
-
-    test_msg = {
-        "t": 3.14159,
-        "x": [1.0] * 15,
-        "P": [[random()] * i for i in range(1, 15 + 1)],
-    }
-    data = msgpack.packb(test_msg)
-    modules[0].broadcast(data)
-    
-    for i, uwb in enumerate(modules[1:]):
-        uwb.wait_for_messages()
-
-    for tracker in trackers:
-        assert msgpack.unpackb(tracker.msg) == test_msg
-
-
-def test_discovery():
+def test_discovery(modules, module, module_ids):
     if len(modules) < 2:
         pytest.skip("At least two modules need to be connected.")
 
     # Get actual IDs of boards connected to this comp
-    tag_ids = [uwb.get_id()["id"] for uwb in modules]
-
-    for j, uwb in enumerate(modules):
-        my_id = tag_ids[j]
-        neighbor_ids = [i for i in tag_ids if i != my_id]
-        neighbor_ids.sort()
-        discovered_ids = uwb.do_discovery()
-
-        assert set(neighbor_ids) <= set(discovered_ids)
+    neighbor_ids = set(module_ids.values()) - {module_ids[id(module)]}
+    discovered_ids = module.do_discovery()
 
+    assert neighbor_ids <= set(discovered_ids)
 
-if __name__ == "__main__":
-    test_twr()